@@ -1,10 +1,14 @@
 import atexit
 import contextlib
-import io
 import logging
+import os
 import pickle
+import pickletools
+import queue
+import sqlite3
 import sys
-from collections import OrderedDict
+import threading
+from abc import abstractmethod
 from collections.abc import (
     Callable,
     Hashable,
@@ -15,10 +19,10 @@ from collections.abc import (
     ValuesView,
 )
 from functools import _make_key, update_wrapper
-from io import BytesIO
+from itertools import islice
 from pathlib import Path
 from types import TracebackType
-from typing import Any, ParamSpec, TypeVar
+from typing import Any, Literal, ParamSpec, TypeVar
 from weakref import WeakSet
 
 __version__ = "1.0.0"
@@ -27,10 +31,16 @@ __copyright__ = "Copyright 2024 Joshua Peek"
 __license__ = "MIT"
 
 _logger = logging.getLogger("lru_cache")
-_caches: WeakSet["PersistentLRUCache"] = WeakSet()
+_caches: WeakSet["BasePersistentLRUCache"] = WeakSet()
+_writes: "queue.Queue[tuple[PersistentLRUCache, Callable[[], None]]]" = queue.Queue()
+_writer_thread: threading.Thread | None = None
+_writer_lock = threading.Lock()
+# Notified whenever a cache's pending writes go down
+_written = threading.Condition()
 
 _SENTINEL = object()
 _KWD_MARK = ("__KWD_MARK__",)
+_BUFFERS_MARK = "__BUFFERS_MARK__"
 
 T = TypeVar("T")
 P = ParamSpec("P")
@@ -56,18 +66,61 @@ def format_bytesize(size: int) -> str:
     return f"{s:.1f} GB"
 
 
+class _CountingSink:
+    """A write-only file that counts the bytes written to it."""
+
+    __slots__ = ("size",)
+
+    def __init__(self) -> None:
+        self.size = 0
+
+    def write(self, b: bytes) -> int:
+        n = len(b)
+        self.size += n
+        return n
+
+
+def _pickle_bytesize(obj: Any) -> int:
+    """Return the size of obj when pickled without building the bytes."""
+    sink = _CountingSink()
+    pickle.Pickler(sink, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return sink.size
+
+
+def _embedded_bytesize(obj: Any) -> int:
+    """Estimate the number of bytes obj contributes to a larger pickle."""
+    # Strip the PROTO and STOP opcodes and the FRAME header, which is only
+    # written when the payload including STOP is at least 4 bytes.
+    size = _pickle_bytesize(obj) - 3
+    if size >= 3 + 9:
+        size -= 9
+    return size
+
+
 DEFAULT_MAX_ITEMS = sys.maxsize
 DEFAULT_MAX_BYTESIZE = bytesize(mb=10)
+DEFAULT_JOURNAL_THRESHOLD = 0
 
 
 class LRUCache(MutableMapping[Hashable, Any]):
     """An LRU cache that acts like a dict and a configurable max size."""
 
-    _data: OrderedDict[Hashable, Any]
+    __slots__ = (
+        "_data",
+        "_max_items",
+        "_max_bytesize",
+        "_entry_sizes",
+        "_did_change",
+        "_needs_trim",
+        "__weakref__",
+    )
+
+    _data: dict[Hashable, Any]
     _max_items: int
     _max_bytesize: int
-    _did_change: bool = False
-    _needs_trim: bool = True
+    _entry_sizes: dict[Hashable, int]
+    _did_change: bool
+    _needs_trim: bool
 
     def __init__(
         self,
@@ -75,20 +128,31 @@ class LRUCache(MutableMapping[Hashable, Any]):
         max_bytesize: int = DEFAULT_MAX_BYTESIZE,
     ) -> None:
         """Create a new LRUCache."""
-        self._data = OrderedDict()
+        self._data = {}
         self._max_items = max_items
         self._max_bytesize = max_bytesize
+        self._entry_sizes = {}
+        self._did_change = False
+        self._needs_trim = True
 
     def __repr__(self) -> str:
         count = len(self)
         size = format_bytesize(self.bytesize())
         return f"<LRUCache {count} items, {size}>"
 
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (
+            self.__class__,
+            (self._max_items, self._max_bytesize),
+            None,
+            None,
+            iter(self._data.items()),
+        )
+
     def __eq__(self, other: Any) -> bool:
         return other is self
 
-    def __hash__(self) -> int:
-        return id(self)
+    __hash__ = object.__hash__
 
     def __contains__(self, key: Hashable) -> bool:
         """Return True if key is in the cache."""
@@ -104,24 +168,28 @@ class LRUCache(MutableMapping[Hashable, Any]):
 
     def __getitem__(self, key: Hashable) -> Any:
         """Return value for key in cache, else None."""
-        value = self._data[key]
-        _logger.debug("hit key=%s", key)
+        self._data[key] = value = self._data.pop(key)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("hit key=%s", key)
         self._did_change = True
-        self._data.move_to_end(key, last=True)
         return value
 
     def __setitem__(self, key: Hashable, value: Any) -> None:
         """Set value for key in cache."""
-        _logger.debug("set key=%s", key)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("set key=%s", key)
         self._did_change = True
         self._needs_trim = True
+        self._entry_sizes.pop(key, None)
+        self._data.pop(key, None)
         self._data[key] = value
-        self._data.move_to_end(key, last=True)
 
     def __delitem__(self, key: Hashable) -> None:
         """Delete key from cache."""
-        _logger.debug("del key=%s", key)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("del key=%s", key)
         self._did_change = True
+        self._entry_sizes.pop(key, None)
         del self._data[key]
 
     def keys(self) -> KeysView[Hashable]:
@@ -138,14 +206,16 @@ class LRUCache(MutableMapping[Hashable, Any]):
 
     def get(self, key: Hashable, default: Any = None) -> Any | None:
         """Return value for key in cache, else default."""
-        value = self._data.get(key, _SENTINEL)
+        value = self._data.pop(key, _SENTINEL)
         if value is _SENTINEL:
-            _logger.debug("miss key=%s", key)
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug("miss key=%s", key)
             return default
         else:
-            _logger.debug("hit key=%s", key)
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug("hit key=%s", key)
             self._did_change = True
-            self._data.move_to_end(key, last=True)
+            self._data[key] = value
             return value
 
     def clear(self) -> None:
@@ -153,78 +223,152 @@ class LRUCache(MutableMapping[Hashable, Any]):
         _logger.debug("clear")
         self._did_change = True
         self._needs_trim = False
+        self._entry_sizes.clear()
         self._data.clear()
 
-    def trim(self) -> int:
-        """Trim the cache to fit within the max bytesize."""
-        if not self._needs_trim:
-            _logger.debug("skipping trim")
-            return 0
-
-        sorted_keys = list(self._data.keys())
-        count = 0
+    def trim(self, size: int | None = None) -> int:
+        """Trim the cache to fit within the max bytesize.
 
-        def _pop() -> None:
-            nonlocal count
-            key = sorted_keys.pop(0)
-            self._did_change = True
-            del self._data[key]
-            count += 1
+        Pass size if the current bytesize of the cache is already known.
+        """
+        count, _ = self._trim(size)
+        return count
 
-        while len(self._data) > self._max_items:
-            _pop()
+    def _trim(
+        self, size: int | None = None, estimate: bool = False
+    ) -> tuple[int, int | None]:
+        # With estimate, the cache is only pickled when _estimate_bytesize()
+        # is near the max. Estimates miss values grown in place, so callers
+        # that use it have to check the size they end up writing. Returns the
+        # number of items trimmed and the size they were trimmed to.
+        if size is None and not self._needs_trim:
+            _logger.debug("skipping trim")
+            return 0, None
 
-        buf = BytesIO()
-        while self._bytesize(buf) > self._max_bytesize:
-            _pop()
+        count = self._trim_items()
+        if count > 0:
+            size = None
+
+        if size is None and estimate:
+            size = self._estimate_bytesize()
+            if size is not None and size > self._max_bytesize * 0.9:
+                size = None
+        if size is None:
+            size = self.bytesize()
+        if size > self._max_bytesize:
+            # The real size is over, so size the items again in case the
+            # cached sizes are stale
+            self._entry_sizes.clear()
+        while size > self._max_bytesize and self._data:
+            keys = []
+            for key, value in self._data.items():
+                if size <= self._max_bytesize:
+                    break
+                keys.append(key)
+                size -= self._entry_bytesize(key, value)
+            count += self._evict(keys)
+            # Estimates ignore shared references, verify the real size
+            size = self.bytesize()
 
         self._needs_trim = False
         if count > 0:
             _logger.warning("trimmed %i items", count)
-        return count
+        return count, size
+
+    def _trim_items(self) -> int:
+        if len(self._data) <= self._max_items:
+            return 0
+        return self._evict(list(islice(self._data, len(self._data) - self._max_items)))
+
+    def _evict(self, keys: list[Hashable]) -> int:
+        # Keys are collected up front since repeatedly taking the first key of
+        # a dict while deleting from its front is quadratic.
+        for key in keys:
+            del self._data[key]
+            self._entry_sizes.pop(key, None)
+        if keys:
+            self._did_change = True
+        return len(keys)
+
+    def _entry_bytesize(self, key: Hashable, value: Any) -> int:
+        size = self._entry_sizes.get(key)
+        if size is None:
+            size = _embedded_bytesize(key) + _embedded_bytesize(value)
+            self._entry_sizes[key] = size
+        return size
+
+    def _estimate_bytesize(self) -> int | None:
+        # Sizing every item on its own costs several full pickle passes, so
+        # only subclasses that know a recent size have a cheaper estimate
+        return None
 
     def bytesize(self) -> int:
         """Return the persisted size of the cache in bytes."""
-        return self._bytesize(BytesIO())
-
-    def _bytesize(self, buf: BytesIO) -> int:
-        buf.seek(0)
-        p = pickle.Pickler(buf, protocol=pickle.HIGHEST_PROTOCOL)
-        p.dump(self._data)
-        return buf.tell()
+        return _pickle_bytesize(self._data)
 
     def get_or_load(self, key: Hashable, load_value: Callable[[], T]) -> T:
         """Get value for key in cache, else load the value and store it in the cache."""
-        value: T = self._data.get(key, _SENTINEL)
+        value: T = self._data.pop(key, _SENTINEL)
         if value is _SENTINEL:
-            _logger.debug("miss key=%s", key)
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug("miss key=%s", key)
             value = load_value()
             self._did_change = True
             self._needs_trim = True
             self._data[key] = value
             return value
         else:
-            _logger.debug("hit key=%s", key)
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug("hit key=%s", key)
             self._did_change = True
-            self._data.move_to_end(key, last=True)
+            self._data[key] = value
             return value
 
     def __call__(self, func: Callable[P, R]) -> Callable[P, R]:
+        prefix = (func.__module__, func.__name__)
+        data = self._data
+        sentinel = _SENTINEL
+
+        # Inlined get_or_load() to keep attribute lookups off the hot path
         def _inner(*args: P.args, **kwds: P.kwargs) -> R:
-            keys = _make_key(args=args, kwds=kwds, typed=True, kwd_mark=_KWD_MARK)
-            assert isinstance(keys, list)
-            key = (func.__module__, func.__name__, *keys)
-            return self.get_or_load(key, lambda: func(*args, **kwds))
+            if kwds:
+                keys = _make_key(args=args, kwds=kwds, typed=True, kwd_mark=_KWD_MARK)
+                assert isinstance(keys, list)
+                key = (*prefix, *keys)
+            else:
+                # Same key _make_key(typed=True) builds, without the _HashedSeq
+                key = (*prefix, *args, *map(type, args))
+            value: R = data.pop(key, sentinel)
+            if value is sentinel:
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("miss key=%s", key)
+                value = func(*args, **kwds)
+                self._needs_trim = True
+            elif _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug("hit key=%s", key)
+            self._did_change = True
+            data[key] = value
+            return value
 
         return update_wrapper(_inner, func)
 
 
-class PersistentLRUCache(LRUCache, contextlib.AbstractContextManager["LRUCache"]):
-    """A managed LRUCache that is persist to disk."""
+class BasePersistentLRUCache(
+    LRUCache, contextlib.AbstractContextManager["BasePersistentLRUCache"]
+):
+    """A managed LRUCache that is persisted to disk.
+
+    Subclasses load the cache from filename in _load() and write it in
+    save(). The snapshot of the last saved items lets them write only what
+    changed since.
+    """
+
+    __slots__ = ("filename", "closed", "_saved", "_saved_bytesize")
 
-    _file: io.BufferedRandom | None = None
     filename: Path
-    closed: bool = False
+    closed: bool
+    _saved: dict[Hashable, Any]
+    _saved_bytesize: int | None
 
     def __init__(
         self,
@@ -233,15 +377,23 @@ class PersistentLRUCache(LRUCache, contextlib.AbstractContextManager["LRUCache"]
         max_bytesize: int = DEFAULT_MAX_BYTESIZE,
     ) -> None:
         self.filename = Path(filename)
+        self._saved = {}
+        self._saved_bytesize = None
         super().__init__(max_items=max_items, max_bytesize=max_bytesize)
         self._load()
+        # Only set once loaded, so __del__ doesn't save over a cache that
+        # failed to load
+        self.closed = False
         _caches.add(self)
 
+    def __reduce__(self) -> tuple[Any, ...]:
+        raise TypeError(f"cannot pickle {self.__class__.__name__!r} object")
+
     def __del__(self) -> None:
-        if not self.closed:
+        if not getattr(self, "closed", True):
             self.close()
 
-    def __enter__(self) -> "PersistentLRUCache":
+    def __enter__(self) -> "BasePersistentLRUCache":
         return self
 
     def __exit__(
@@ -252,73 +404,491 @@ class PersistentLRUCache(LRUCache, contextlib.AbstractContextManager["LRUCache"]
     ) -> None:
         self.close()
 
-    def _open(self) -> io.BufferedRandom:
-        if self._file:
-            return self._file
-        self.filename.parent.mkdir(parents=True, exist_ok=True)
-        self.filename.touch(exist_ok=True)
-        self._file = self.filename.open(mode="rb+")
-        _logger.debug("opened cache %d '%s'", self._file.fileno(), self.filename)
-        return self._file
+    @abstractmethod
+    def _load(self) -> None: ...
+
+    def _snapshot(self) -> None:
+        self._saved = dict(self._data)
+
+    @abstractmethod
+    def save(self) -> None:
+        """Save the cache to disk."""
+
+    def _trim_saved(self) -> None:
+        _, size = self._trim(estimate=True)
+        # The size has to follow the snapshot even when the trim is skipped
+        self._saved_bytesize = self._estimate_bytesize() if size is None else size
+
+    def _estimate_bytesize(self) -> int | None:
+        # Add the items changed since the last save to the size the cache had
+        # then. Removed items aren't taken off, so this errs high until the
+        # next full pickle pass.
+        if self._saved_bytesize is None:
+            return None
+        saved = self._saved
+        entry_bytesize = self._entry_bytesize
+        size = self._saved_bytesize
+        for key, value in self._data.items():
+            if saved.get(key, _SENTINEL) is not value:
+                size += entry_bytesize(key, value)
+        return size
+
+    def flush(self) -> None:
+        """Wait for pending saves to be written to disk."""
+
+    def close(self) -> None:
+        """Close the cache and save it to disk."""
+        if self.closed:
+            raise ValueError("cache is already closed")
+        self.save()
+        self.flush()
+        _logger.debug("closed cache '%s'", self.filename)
+        self.closed = True
+
+
+class PersistentLRUCache(BasePersistentLRUCache):
+    """A managed LRUCache that is persisted to disk as a pickle file.
+
+    When journal_threshold is set, saves append the items that changed since
+    the last save to a ".journal" file next to the cache instead of rewriting
+    it. The journal is compacted into the cache file after that many saves.
+    Values mutated in place are not detected as changed while journaling.
+
+    When optimize_on_save is set, the cache file is run through
+    pickletools.optimize before being written. That makes the file about 10%
+    smaller and faster to load, but optimize is pure Python and can make a
+    save many times slower while holding the GIL. It only pays off for caches
+    that are loaded many times for each save.
+
+    Values that pickle their data as out-of-band buffers with protocol 5,
+    like numpy arrays, have those buffers written to the file as is instead
+    of copied into the pickle. Since the buffers are the values' own memory,
+    a save that writes them waits for the write to finish, as with flush().
+
+    Saves are pickled in the calling thread and written to disk by a
+    background thread. Use flush() to wait for them to finish, close() does
+    so automatically.
+    """
+
+    __slots__ = (
+        "journal_filename",
+        "journal_threshold",
+        "optimize_on_save",
+        "_journal_count",
+        "_write_error",
+        "_write_failed",
+        "_pending_writes",
+    )
+
+    journal_filename: Path
+    journal_threshold: int
+    optimize_on_save: bool
+    _journal_count: int
+    _write_error: Exception | None
+    _write_failed: bool
+    _pending_writes: int
+
+    def __init__(
+        self,
+        filename: Path | str,
+        max_items: int = DEFAULT_MAX_ITEMS,
+        max_bytesize: int = DEFAULT_MAX_BYTESIZE,
+        journal_threshold: int = DEFAULT_JOURNAL_THRESHOLD,
+        optimize_on_save: bool = False,
+    ) -> None:
+        filename = Path(filename)
+        self.journal_filename = filename.with_name(filename.name + ".journal")
+        self.journal_threshold = journal_threshold
+        self.optimize_on_save = optimize_on_save
+        self._journal_count = 0
+        self._write_error = None
+        self._write_failed = False
+        self._pending_writes = 0
+        super().__init__(
+            filename=filename,
+            max_items=max_items,
+            max_bytesize=max_bytesize,
+        )
 
     def _load(self) -> None:
         if not self.filename.exists():
             _logger.debug("cache not found: '%s'", self.filename)
             return
 
-        f = self._open()
-        self._data.update(pickle.load(f))
+        with self.filename.open(mode="rb") as f:
+            data = pickle.load(f)
+            if isinstance(data, tuple) and data[0] == _BUFFERS_MARK:
+                buffers = []
+                for nbytes in data[1]:
+                    b = bytearray(nbytes)
+                    if f.readinto(b) != nbytes:
+                        raise EOFError("cache buffers are truncated")
+                    buffers.append(b)
+                data = pickle.load(f, buffers=buffers)
+            self._data.update(data)
         self._did_change = False
+        self._load_journal()
+        self._snapshot()
+
+        if _logger.isEnabledFor(logging.INFO):
+            _logger.info(
+                "loaded cache: '%s' (%i items, %s bytes)",
+                self.filename,
+                len(self),
+                format_bytesize(self.bytesize()),
+            )
+
+    def _load_journal(self) -> None:
+        if not self.journal_filename.exists():
+            return
 
-        _logger.info(
-            "loaded cache: '%s' (%i items, %s bytes)",
-            self.filename,
-            len(self),
-            format_bytesize(self.bytesize()),
+        with self.journal_filename.open(mode="rb") as f:
+            while f.peek(1):
+                try:
+                    self._replay(*pickle.load(f))
+                except (EOFError, pickle.UnpicklingError, TypeError, ValueError):
+                    _logger.warning("corrupt journal: '%s'", self.journal_filename)
+                    self._did_change = True
+                    self._journal_count = self.journal_threshold
+                    break
+                self._journal_count += 1
+
+        _logger.debug(
+            "replayed %i journal entries: '%s'",
+            self._journal_count,
+            self.journal_filename,
         )
 
+    def _replay(
+        self,
+        deleted: list[Hashable],
+        changed: dict[Hashable, Any],
+        moved: list[Hashable],
+    ) -> None:
+        data = self._data
+        # Check the record first so a bad one isn't half applied
+        if any(key not in data for key in deleted) or any(
+            key not in data and key not in changed for key in moved
+        ):
+            raise ValueError("journal record doesn't match the cache")
+        for key in deleted:
+            del data[key]
+        for key in moved:
+            data[key] = changed.get(key, data.pop(key, None))
+
+    def _snapshot(self) -> None:
+        if self.journal_threshold > 0:
+            super()._snapshot()
+
     def save(self) -> None:
-        """Save the cache to disk."""
+        """Save the cache to disk in the background."""
         if self._did_change is False:
             _logger.debug("no changes to save")
             return
 
-        self.trim()
+        # After a failed write the file on disk is behind the snapshot that
+        # journals are diffed against, so rewrite it in full
+        if (
+            not self._write_failed
+            and self._journal_count < self.journal_threshold
+            and self.filename.exists()
+        ):
+            self._trim_saved()
+            write, wait = self._prepare_journal(), False
+        else:
+            write, wait = self._prepare_write()
+        self._snapshot()
+        self._did_change = False
+        _enqueue_write(self, write)
+        if wait:
+            self.flush()
+
+    def flush(self) -> None:
+        """Wait for pending saves to be written to disk."""
+        if threading.current_thread() is _writer_thread:
+            return
+        # Only wait for this cache's writes, other caches may keep saving
+        with _written:
+            _written.wait_for(lambda: not self._pending_writes)
+        if error := self._write_error:
+            self._write_error = None
+            raise error
+
+    def _dumps(self) -> tuple[bytes, list[memoryview], int]:
+        # Buffers of values that support pickle protocol 5 are kept out of the
+        # pickle and written to the file as is, rather than copied into it
+        buffers: list[pickle.PickleBuffer] = []
+        buf = pickle.dumps(
+            self._data, pickle.HIGHEST_PROTOCOL, buffer_callback=buffers.append
+        )
+        views = [b.raw() for b in buffers]
+        return buf, views, len(buf) + sum(view.nbytes for view in views)
+
+    def _prepare_write(self) -> tuple[Callable[[], None], bool]:
+        # The pickle is sized as it's dumped, so only max_items has to be
+        # trimmed up front
+        if count := self._trim_items():
+            _logger.warning("trimmed %i items", count)
+        # Out-of-band buffers are views of the live values, so the caller has
+        # to wait for them to be written before the values can change
+        buf, views, size = self._dumps()
+        if size > self._max_bytesize:
+            _release(views)
+            self.trim(size)
+            buf, views, size = self._dumps()
+        self._needs_trim = False
+        self._saved_bytesize = size
+        self._journal_count = 0
+        count = len(self)
+
+        def _write() -> None:
+            # Write to a temporary file and swap it in so a crash mid-write
+            # can't leave a truncated cache behind
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+            tmp_filename = self.filename.with_name(self.filename.name + ".tmp")
+            try:
+                with tmp_filename.open(mode="wb") as f:
+                    if views:
+                        header = (_BUFFERS_MARK, [view.nbytes for view in views])
+                        pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                        for view in views:
+                            f.write(view)
+                    f.write(pickletools.optimize(buf) if self.optimize_on_save else buf)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except BaseException:
+                tmp_filename.unlink(missing_ok=True)
+                raise
+            finally:
+                # Let the values be resized again
+                _release(views)
+            # Drop the journal first, replaying it over the new cache would
+            # restore stale values
+            self.journal_filename.unlink(missing_ok=True)
+            os.replace(tmp_filename, self.filename)
+            self._write_failed = False
+            _logger.info(
+                "saved cache: '%s' (%i items, %s)",
+                self.filename,
+                count,
+                format_bytesize(size),
+            )
+
+        return _write, bool(views)
+
+    def _prepare_journal(self) -> Callable[[], None]:
+        saved = self._saved
+        saved_keys = iter(saved)
+        changed: dict[Hashable, Any] = {}
+        moved: list[Hashable] = []
+        # Items still in their saved order keep their place. Everything from
+        # the first item that was added, changed or moved is re-appended, which
+        # for LRU access is just the items touched since the last save.
+        for key, value in self._data.items():
+            unchanged = saved.get(key, _SENTINEL) is value
+            # "in" advances saved_keys, so kept keys must be in saved order
+            if not moved and unchanged and key in saved_keys:
+                continue
+            moved.append(key)
+            if not unchanged:
+                changed[key] = value
+        deleted = [key for key in saved if key not in self._data]
+        buf = pickle.dumps((deleted, changed, moved), pickle.HIGHEST_PROTOCOL)
+        self._journal_count += 1
+
+        def _write() -> None:
+            if self._write_failed:
+                # The record is relative to a save that never made it to disk
+                _logger.debug("skipping journal: '%s'", self.journal_filename)
+                self._did_change = True
+                return
+            with self.journal_filename.open(mode="ab") as f:
+                f.write(buf)
+            _logger.debug(
+                "journaled %i changed, %i moved, %i deleted items: '%s'",
+                len(changed),
+                len(moved),
+                len(deleted),
+                self.journal_filename,
+            )
+
+        return _write
+
+
+class SQLitePersistentLRUCache(BasePersistentLRUCache):
+    """A managed LRUCache that is persisted to disk as a SQLite database.
+
+    Each item is a row holding its pickled key and value, and its position in
+    the LRU order. Saves only write the rows that were added, changed, moved
+    or removed since the last save, synchronously in the calling thread.
+    Values mutated in place are not detected as changed.
+    """
+
+    __slots__ = ("_connection", "_rows", "_next_id", "_next_ord")
+
+    _connection: sqlite3.Connection | None
+    _rows: dict[Hashable, tuple[int, int]]
+    _next_id: int
+    _next_ord: int
+
+    def __init__(
+        self,
+        filename: Path | str,
+        max_items: int = DEFAULT_MAX_ITEMS,
+        max_bytesize: int = DEFAULT_MAX_BYTESIZE,
+    ) -> None:
+        self._connection = None
+        self._rows = {}
+        self._next_id = 1
+        self._next_ord = 1
+        super().__init__(
+            filename=filename,
+            max_items=max_items,
+            max_bytesize=max_bytesize,
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection:
+            return self._connection
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        # The cache may be closed from another thread, like by atexit or gc
+        self._connection = sqlite3.connect(self.filename, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "id INTEGER PRIMARY KEY, k BLOB NOT NULL, v BLOB NOT NULL, "
+                "ord INTEGER NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_ord ON cache (ord)"
+            )
+        _logger.debug("opened cache '%s'", self.filename)
+        return self._connection
+
+    def _load(self) -> None:
+        if not self.filename.exists():
+            _logger.debug("cache not found: '%s'", self.filename)
+            return
+
+        rows = self._connect().execute("SELECT id, k, v, ord FROM cache ORDER BY ord")
+        for rowid, k, v, order in rows:
+            key = pickle.loads(k)
+            self._data[key] = pickle.loads(v)
+            self._rows[key] = (rowid, order)
+            self._next_id = max(self._next_id, rowid + 1)
+            self._next_ord = order + 1
+        self._did_change = False
+        self._snapshot()
+
+        _logger.info("loaded cache: '%s' (%i items)", self.filename, len(self))
+
+    def save(self) -> None:
+        """Save the changed items to the database."""
+        if self._did_change is False:
+            _logger.debug("no changes to save")
+            return
+
+        # Values grown in place aren't written either, so estimates are enough
+        self._trim_saved()
+
+        saved = self._saved
+        rows: dict[Hashable, tuple[int, int]] = {}
+        inserts: list[tuple[int, bytes, bytes, int]] = []
+        updates: list[tuple[bytes, int, int]] = []
+        moves: list[tuple[int, int]] = []
+        next_id, next_ord = self._next_id, self._next_ord
+        last_ord = 0
+
+        # Rows keep their ord as long as it stays increasing, only items that
+        # were added, changed or moved ahead of others get a new one
+        for key, value in self._data.items():
+            row = self._rows.get(key)
+            if row is None:
+                row = (next_id, next_ord)
+                next_id += 1
+                next_ord += 1
+                inserts.append(
+                    (
+                        row[0],
+                        pickle.dumps(key, pickle.HIGHEST_PROTOCOL),
+                        pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                        row[1],
+                    )
+                )
+            elif saved.get(key, _SENTINEL) is not value:
+                row = (row[0], next_ord)
+                next_ord += 1
+                updates.append(
+                    (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), row[1], row[0])
+                )
+            elif row[1] < last_ord:
+                row = (row[0], next_ord)
+                next_ord += 1
+                moves.append((row[1], row[0]))
+            rows[key] = row
+            last_ord = row[1]
+        deletes = [(row[0],) for key, row in self._rows.items() if key not in rows]
+
+        with self._connect() as connection:
+            connection.executemany("DELETE FROM cache WHERE id = ?", deletes)
+            connection.executemany(
+                "INSERT INTO cache (id, k, v, ord) VALUES (?, ?, ?, ?)", inserts
+            )
+            connection.executemany(
+                "UPDATE cache SET v = ?, ord = ? WHERE id = ?", updates
+            )
+            connection.executemany("UPDATE cache SET ord = ? WHERE id = ?", moves)
+
+        self._rows = rows
+        self._next_id, self._next_ord = next_id, next_ord
+        self._snapshot()
+        self._did_change = False
         _logger.info(
-            "saving cache: '%s' (%i items, %s)",
+            "saved cache: '%s' (%i inserted, %i updated, %i moved, %i deleted)",
             self.filename,
-            len(self),
-            format_bytesize(self.bytesize()),
+            len(inserts),
+            len(updates),
+            len(moves),
+            len(deletes),
         )
-        f = self._open()
-        f.seek(0)
-        pickle.dump(self._data, f, pickle.HIGHEST_PROTOCOL)
-        self._did_change = False
 
     def close(self) -> None:
         """Close the cache and save it to disk."""
-        if self.closed:
-            assert self._file is None, "file should be closed"
-            raise ValueError("cache is already closed")
-        self.save()
-        if self._file:
-            fd = self._file.fileno()
-            self._file.close()
-            self._file = None
-            _logger.debug("closed cache %d '%s'", fd, self.filename)
-        self.closed = True
+        super().close()
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+            _logger.debug("closed connection '%s'", self.filename)
 
 
 def open(
     filename: Path | str,
     max_items: int = DEFAULT_MAX_ITEMS,
     max_bytesize: int = DEFAULT_MAX_BYTESIZE,
-) -> PersistentLRUCache:
-    return PersistentLRUCache(
-        filename=filename,
-        max_items=max_items,
-        max_bytesize=max_bytesize,
-    )
+    journal_threshold: int = DEFAULT_JOURNAL_THRESHOLD,
+    optimize_on_save: bool = False,
+    backend: Literal["pickle", "sqlite"] = "pickle",
+) -> BasePersistentLRUCache:
+    if backend == "sqlite":
+        if journal_threshold != DEFAULT_JOURNAL_THRESHOLD:
+            raise ValueError("journal_threshold isn't supported by sqlite backend")
+        if optimize_on_save:
+            raise ValueError("optimize_on_save isn't supported by sqlite backend")
+        return SQLitePersistentLRUCache(
+            filename=filename,
+            max_items=max_items,
+            max_bytesize=max_bytesize,
+        )
+    elif backend == "pickle":
+        return PersistentLRUCache(
+            filename=filename,
+            max_items=max_items,
+            max_bytesize=max_bytesize,
+            journal_threshold=journal_threshold,
+            optimize_on_save=optimize_on_save,
+        )
+    else:
+        raise ValueError(f"unknown backend: {backend!r}")
 
 
 def _close_atexit() -> None:
@@ -327,6 +897,59 @@ def _close_atexit() -> None:
         _logger.warning("closing open %d caches", len(open_caches))
     for cache in open_caches:
         cache.close()
+    _writes.join()
+
+
+def _enqueue_write(cache: PersistentLRUCache, write: Callable[[], None]) -> None:
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(
+                target=_drain_writes, name="lru_cache writer", daemon=True
+            )
+            _writer_thread.start()
+    with _written:
+        cache._pending_writes += 1
+    _writes.put((cache, write))
+
+
+def _release(views: list[memoryview]) -> None:
+    for view in views:
+        view.release()
+
+
+def _reset_writer() -> None:
+    # A forked child only gets the thread that forked, so start over with a
+    # writer of its own. Writes still pending are left to the parent.
+    global _writes, _writer_thread, _writer_lock, _written
+    _writes = queue.Queue()
+    _writer_thread = None
+    _writer_lock = threading.Lock()
+    _written = threading.Condition()
+    for cache in _caches:
+        if isinstance(cache, PersistentLRUCache):
+            cache._pending_writes = 0
+
+
+def _drain_writes() -> None:
+    while True:
+        cache, write = _writes.get()
+        try:
+            write()
+        except Exception as e:
+            _logger.exception("failed to save cache: '%s'", cache.filename)
+            cache._did_change = True
+            cache._write_error = e
+            cache._write_failed = True
+        finally:
+            with _written:
+                cache._pending_writes -= 1
+                _written.notify_all()
+            # Don't keep the last cache alive while waiting for more writes
+            del cache, write
+            _writes.task_done()
 
 
 atexit.register(_close_atexit)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_writer)
@@ -1,4 +1,13 @@
+import contextlib
+import gc
+import os
+import pickle
+import signal
+import sqlite3
+import sys
+import threading
 from pathlib import Path
+from typing import Any, SupportsIndex
 
 import pytest
 
@@ -6,6 +15,28 @@ import lru_cache
 from lru_cache import LRUCache, PersistentLRUCache, bytesize, format_bytesize
 
 
+class ZeroCopyBytes(bytes):
+    def __reduce_ex__(self, protocol: SupportsIndex) -> Any:
+        if int(protocol) >= 5:
+            return type(self)._reconstruct, (pickle.PickleBuffer(self),)
+        return type(self)._reconstruct, (bytes(self),)
+
+    @classmethod
+    def _reconstruct(cls, obj: Any) -> "ZeroCopyBytes":
+        return cls(obj)
+
+
+class ZeroCopyByteArray(bytearray):
+    def __reduce_ex__(self, protocol: SupportsIndex) -> Any:
+        if int(protocol) >= 5:
+            return type(self)._reconstruct, (pickle.PickleBuffer(self),)
+        return type(self)._reconstruct, (bytes(self),)
+
+    @classmethod
+    def _reconstruct(cls, obj: Any) -> "ZeroCopyByteArray":
+        return cls(obj)
+
+
 @pytest.fixture()
 def cache() -> LRUCache:
     return LRUCache()
@@ -27,6 +58,12 @@ def test_hash(cache: LRUCache) -> None:
     assert hash(cache) != hash(LRUCache())
 
 
+def test_slots(cache: LRUCache) -> None:
+    assert not hasattr(cache, "__dict__")
+    with pytest.raises(AttributeError):
+        cache.foo = 42  # type: ignore[attr-defined]
+
+
 def test_item_get_set(cache: LRUCache) -> None:
     pytest.raises(KeyError, lambda: cache["key"])
 
@@ -46,9 +83,22 @@ def test_item_del(cache: LRUCache) -> None:
 
 
 def test_repr(cache: LRUCache) -> None:
-    assert repr(cache) == "<LRUCache 0 items, 45.0 B>"
+    assert repr(cache) == "<LRUCache 0 items, 5.0 B>"
     cache["key"] = 1
-    assert repr(cache) == "<LRUCache 1 items, 54.0 B>"
+    assert repr(cache) == "<LRUCache 1 items, 23.0 B>"
+
+
+def test_pickle(cache: LRUCache) -> None:
+    cache["key1"] = 1
+    cache["key2"] = 2
+    cache["key1"]
+    copy = pickle.loads(pickle.dumps(cache))
+    assert isinstance(copy, LRUCache)
+    assert list(copy.items()) == [("key2", 2), ("key1", 1)]
+
+
+def test_pickle_persistent(file_cache: PersistentLRUCache) -> None:
+    pytest.raises(TypeError, lambda: pickle.dumps(file_cache))
 
 
 def test_contains(cache: LRUCache) -> None:
@@ -148,6 +198,78 @@ def test_trim_max_bytesize() -> None:
     assert cache.bytesize() <= 1024
 
 
+def test_save_under_max_bytesize_skips_pickle(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def _bytesize(self: LRUCache) -> int:
+        raise AssertionError("unexpected full pickle")
+
+    path = tmp_path / "cache.pickle"
+    cache = PersistentLRUCache(filename=path, max_bytesize=1024, journal_threshold=5)
+    for i in range(10):
+        cache[i] = i
+    cache.save()
+    monkeypatch.setattr(LRUCache, "bytesize", _bytesize)
+    cache[10] = 10
+    cache.save()
+    cache[0]
+    cache.save()
+    cache[11] = 11
+    cache.save()
+    cache.flush()
+    assert len(cache) == 12
+
+
+@pytest.mark.parametrize(
+    "kwds", [{}, {"journal_threshold": 5}, {"backend": "sqlite"}], ids=repr
+)
+def test_save_skips_sizing_items(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, kwds: dict[str, Any]
+) -> None:
+    # Sizing items one by one is several times slower than one pickle pass
+    def _embedded_bytesize(obj: Any) -> int:
+        raise AssertionError("unexpected item sizing")
+
+    path = tmp_path / "cache"
+    with lru_cache.open(path, **kwds) as cache:
+        for i in range(10):
+            cache[i] = i
+
+    monkeypatch.setattr(lru_cache, "_embedded_bytesize", _embedded_bytesize)
+    with lru_cache.open(path, **kwds) as cache:
+        cache[0]
+        cache[10] = 10
+    with lru_cache.open(path, **kwds) as cache:
+        assert len(cache) == 11
+
+
+def test_trim_value_grown_in_place() -> None:
+    cache = LRUCache(max_bytesize=1024)
+    cache["a"] = []
+    cache["b"] = 1
+    cache.trim()
+    cache["a"].extend(range(500))
+    cache["b"] = 2
+    assert cache.trim() > 0
+    assert cache.bytesize() <= 1024
+    assert "b" in cache
+
+
+def test_trim_max_bytesize_evicts_oldest() -> None:
+    cache = LRUCache(max_bytesize=1024)
+    for i in range(300):
+        cache[str(i)] = i
+    cache["0"]
+    count = cache.trim()
+    assert count > 0
+    assert len(cache) == 300 - count
+    assert "0" in cache
+    assert "1" not in cache
+    assert "299" in cache
+    assert cache.bytesize() <= 1024
+    assert cache.bytesize() > 1024 - 32
+
+
 def test_decorator(cache: LRUCache) -> None:
     @cache
     def fib(n: int) -> int:
@@ -160,6 +282,32 @@ def test_decorator(cache: LRUCache) -> None:
     assert len(cache) == 11
 
 
+def test_decorator_hit_moves_to_end(cache: LRUCache) -> None:
+    @cache
+    def double(n: int) -> int:
+        return n * 2
+
+    assert double(1) == 2
+    assert double(2) == 4
+    assert double(1) == 2
+    assert list(cache.values()) == [4, 2]
+
+
+def test_decorator_keys(cache: LRUCache) -> None:
+    @cache
+    def add(a: float, b: float = 0) -> float:
+        return a + b
+
+    assert add(1) == 1
+    assert add(1.0) == 1.0
+    assert isinstance(add(1.0), float)
+    assert add(1, b=2) == 3
+    assert add(1, b=2) == 3
+    assert len(cache) == 3
+    assert (__name__, "add", 1, int) in cache
+    assert (__name__, "add", 1.0, float) in cache
+
+
 def test_open_managed(tmp_path: Path) -> None:
     path = tmp_path / "cache.pickle"
     assert not path.exists()
@@ -222,10 +370,12 @@ def test_open_with_manual_saves(tmp_path: Path) -> None:
 
     assert not path.exists()
     cache.save()
+    cache.flush()
     assert path.exists()
 
     cache["key"] = 2
     cache.save()
+    cache.flush()
     assert path.exists()
 
     cache.close()
@@ -234,6 +384,395 @@ def test_open_with_manual_saves(tmp_path: Path) -> None:
         assert cache["key"] == 2
 
 
+def test_save_in_background(tmp_path: Path) -> None:
+    path = tmp_path / "cache.pickle"
+
+    cache = lru_cache.open(path)
+    cache["key"] = 1
+    cache.save()
+    cache["key"] = 2
+    cache.flush()
+
+    with lru_cache.open(path) as other_cache:
+        assert other_cache["key"] == 1
+
+    cache.close()
+    with lru_cache.open(path) as cache:
+        assert cache["key"] == 2
+
+
+def test_open_failed(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    unraisable: list[Any] = []
+    monkeypatch.setattr(sys, "unraisablehook", unraisable.append)
+
+    with pytest.raises(TypeError):
+        PersistentLRUCache(None)  # type: ignore[arg-type]
+
+    path = tmp_path / "cache.pickle"
+    path.write_bytes(b"corrupt")
+    with pytest.raises(pickle.UnpicklingError):
+        PersistentLRUCache(path)
+
+    gc.collect()
+    assert unraisable == []
+    assert path.read_bytes() == b"corrupt"
+
+
+def test_save_is_atomic(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = tmp_path / "cache.pickle"
+
+    cache = lru_cache.open(path)
+    cache["key"] = 1
+    cache.save()
+    cache.flush()
+
+    def _fsync(fd: int) -> None:
+        raise OSError("disk full")
+
+    cache["key"] = 2
+    with monkeypatch.context() as m:
+        m.setattr("os.fsync", _fsync)
+        cache.save()
+        pytest.raises(OSError, cache.flush)
+
+    assert [p.name for p in tmp_path.iterdir()] == ["cache.pickle"]
+    with lru_cache.open(path) as other_cache:
+        assert other_cache["key"] == 1
+
+    cache.close()
+    with lru_cache.open(path) as cache:
+        assert cache["key"] == 2
+
+
+def test_save_after_failed_write_rewrites_cache(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = tmp_path / "cache.pickle"
+
+    cache = lru_cache.open(path, journal_threshold=1)
+    cache["a"] = 1
+    cache.save()
+    cache["b"] = 2
+    cache.save()
+    cache.flush()
+
+    def _fsync(fd: int) -> None:
+        raise OSError("disk full")
+
+    cache["c"] = 3
+    with monkeypatch.context() as m:
+        m.setattr("os.fsync", _fsync)
+        cache.save()
+        cache["d"] = 4
+        cache.save()
+        pytest.raises(OSError, cache.flush)
+
+    cache.close()
+    with lru_cache.open(path, journal_threshold=1) as cache:
+        assert list(cache) == ["a", "b", "c", "d"]
+
+
+def test_flush_only_waits_for_own_writes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    release = threading.Event()
+
+    def _fsync(fd: int) -> None:
+        release.wait(timeout=5)
+
+    cache = lru_cache.open(tmp_path / "cache.pickle")
+    cache["key"] = 1
+    cache.save()
+    cache.flush()
+
+    other_cache = lru_cache.open(tmp_path / "other.pickle")
+    other_cache["key"] = 1
+    with monkeypatch.context() as m:
+        m.setattr("os.fsync", _fsync)
+        other_cache.save()
+        thread = threading.Thread(target=cache.close)
+        thread.start()
+        thread.join(timeout=1)
+        closed = not thread.is_alive()
+        release.set()
+        thread.join()
+    other_cache.close()
+    assert closed
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_save_in_forked_child(tmp_path: Path) -> None:
+    path = tmp_path / "cache.pickle"
+
+    cache = lru_cache.open(path)
+    cache["parent"] = 1
+    cache.save()
+    cache.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            signal.alarm(5)
+            cache["child"] = 2
+            cache.save()
+            cache.flush()
+            status = 0
+        finally:
+            os._exit(status)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    with lru_cache.open(path) as other_cache:
+        assert other_cache["child"] == 2
+    cache.close()
+
+
+def test_save_trims_values_grown_in_place(tmp_path: Path) -> None:
+    path = tmp_path / "cache.pickle"
+
+    with lru_cache.open(path, max_bytesize=1024) as cache:
+        cache["a"] = []
+        cache["b"] = 1
+        cache.save()
+
+        cache["a"].extend(range(500))
+        cache["b"] = 2
+        cache.save()
+        cache.flush()
+        assert path.stat().st_size <= 1024
+        assert list(cache.items()) == [("b", 2)]
+
+
+def test_open_with_out_of_band_buffers(tmp_path: Path) -> None:
+    path = tmp_path / "cache.pickle"
+    data = ZeroCopyBytes(b"x" * 1024)
+
+    with lru_cache.open(path) as cache:
+        cache["key1"] = data
+        cache["key2"] = 2
+    assert path.read_bytes().count(data) == 1
+    with path.open(mode="rb") as f:
+        assert pickle.load(f) == ("__BUFFERS_MARK__", [1024])
+        assert f.read(1024) == data
+
+    with lru_cache.open(path) as cache:
+        assert list(cache.keys()) == ["key1", "key2"]
+        assert cache["key1"] == data
+        assert isinstance(cache["key1"], ZeroCopyBytes)
+
+
+def test_save_out_of_band_buffers_before_returning(tmp_path: Path) -> None:
+    path = tmp_path / "cache.pickle"
+    data = ZeroCopyByteArray(b"x" * 1024)
+
+    with lru_cache.open(path) as cache:
+        cache["key"] = data
+        cache.save()
+        data[:] = b"y" * 1024
+        data.extend(b"y")
+
+    with lru_cache.open(path) as cache:
+        assert cache["key"] == b"x" * 1024
+
+
+def test_open_optimize_on_save(tmp_path: Path) -> None:
+    optimized_path = tmp_path / "optimized.pickle"
+    unoptimized_path = tmp_path / "unoptimized.pickle"
+
+    with lru_cache.open(optimized_path, optimize_on_save=True) as cache:
+        for i in range(100):
+            cache[f"key{i}"] = [i]
+    with lru_cache.open(unoptimized_path) as cache:
+        for i in range(100):
+            cache[f"key{i}"] = [i]
+    assert optimized_path.stat().st_size < unoptimized_path.stat().st_size
+
+    with lru_cache.open(optimized_path) as cache:
+        assert len(cache) == 100
+        assert cache["key42"] == [42]
+
+
+def test_open_with_journal(tmp_path: Path) -> None:
+    path = tmp_path / "cache.pickle"
+    journal_path = tmp_path / "cache.pickle.journal"
+
+    with lru_cache.open(path, journal_threshold=2) as cache:
+        cache["key1"] = 1
+        cache["key2"] = 2
+    assert path.exists()
+    assert not journal_path.exists()
+
+    with lru_cache.open(path, journal_threshold=2) as cache:
+        cache["key3"] = 3
+        del cache["key1"]
+    assert journal_path.exists()
+
+    with lru_cache.open(path, journal_threshold=2) as cache:
+        assert list(cache.items()) == [("key2", 2), ("key3", 3)]
+        assert cache["key2"] == 2
+    assert journal_path.exists()
+
+    with lru_cache.open(path, journal_threshold=2) as cache:
+        assert list(cache.keys()) == ["key3", "key2"]
+        cache["key4"] = 4
+    assert not journal_path.exists()
+
+    with lru_cache.open(path) as cache:
+        assert list(cache.items()) == [("key3", 3), ("key2", 2), ("key4", 4)]
+
+
+def test_open_with_journal_only_writes_changes(tmp_path: Path) -> None:
+    path = tmp_path / "cache.pickle"
+    journal_path = tmp_path / "cache.pickle.journal"
+
+    with lru_cache.open(path, journal_threshold=2) as cache:
+        for i in range(1000):
+            cache[("key", i)] = i
+
+    with lru_cache.open(path, journal_threshold=2) as cache:
+        assert cache[("key", 0)] == 0
+        del cache[("key", 1)]
+        cache[("key", 2)] = -2
+    assert journal_path.stat().st_size < path.stat().st_size / 50
+
+    with lru_cache.open(path, journal_threshold=2) as cache:
+        assert len(cache) == 999
+        assert list(cache.items())[:2] == [(("key", 3), 3), (("key", 4), 4)]
+        assert list(cache.items())[-2:] == [(("key", 0), 0), (("key", 2), -2)]
+
+
+def test_open_with_inconsistent_journal(tmp_path: Path) -> None:
+    path = tmp_path / "cache.pickle"
+    journal_path = tmp_path / "cache.pickle.journal"
+
+    with lru_cache.open(path, journal_threshold=5) as cache:
+        cache["key1"] = 1
+    with lru_cache.open(path, journal_threshold=5) as cache:
+        cache["key2"] = 2
+    with journal_path.open(mode="ab") as f:
+        pickle.dump(([], {}, ["missing"]), f)
+
+    with lru_cache.open(path, journal_threshold=5) as cache:
+        assert list(cache.items()) == [("key1", 1), ("key2", 2)]
+    assert not journal_path.exists()
+
+
+def test_open_with_truncated_journal(tmp_path: Path) -> None:
+    path = tmp_path / "cache.pickle"
+    journal_path = tmp_path / "cache.pickle.journal"
+
+    with lru_cache.open(path, journal_threshold=5) as cache:
+        cache["key1"] = 1
+    with lru_cache.open(path, journal_threshold=5) as cache:
+        cache["key2"] = 2
+    with lru_cache.open(path, journal_threshold=5) as cache:
+        cache["key3"] = 3
+    journal_path.write_bytes(journal_path.read_bytes()[:-4])
+
+    with lru_cache.open(path, journal_threshold=5) as cache:
+        assert list(cache.keys()) == ["key1", "key2"]
+    assert not journal_path.exists()
+
+
+def test_open_sqlite(tmp_path: Path) -> None:
+    path = tmp_path / "cache.db"
+    assert not path.exists()
+
+    with lru_cache.open(path, backend="sqlite") as cache:
+        assert len(cache) == 0
+    assert not path.exists()
+
+    with lru_cache.open(path, backend="sqlite") as cache:
+        cache["key1"] = 1
+        cache["key2"] = 2
+        cache["key3"] = 3
+    assert path.exists()
+
+    with lru_cache.open(path, backend="sqlite") as cache:
+        assert list(cache.items()) == [("key1", 1), ("key2", 2), ("key3", 3)]
+        assert cache["key1"] == 1
+        cache["key2"] = 4
+        del cache["key3"]
+        cache["key5"] = 5
+
+    with lru_cache.open(path, backend="sqlite") as cache:
+        assert list(cache.items()) == [("key1", 1), ("key2", 4), ("key5", 5)]
+        cache.clear()
+
+    with lru_cache.open(path, backend="sqlite") as cache:
+        assert len(cache) == 0
+
+
+def test_open_sqlite_only_writes_changes(tmp_path: Path) -> None:
+    path = tmp_path / "cache.db"
+
+    with lru_cache.open(path, backend="sqlite") as cache:
+        cache["key1"] = 1
+        cache["key2"] = 2
+        cache["key3"] = 3
+
+    with lru_cache.open(path, backend="sqlite") as cache:
+        assert cache["key1"] == 1
+
+    with contextlib.closing(sqlite3.connect(path)) as db:
+        rows = db.execute("SELECT id, ord FROM cache ORDER BY id").fetchall()
+    assert rows == [(1, 4), (2, 2), (3, 3)]
+
+
+def test_open_sqlite_trims(tmp_path: Path) -> None:
+    path = tmp_path / "cache.db"
+
+    with lru_cache.open(path, max_items=2, backend="sqlite") as cache:
+        cache["key1"] = 1
+        cache["key2"] = 2
+        cache["key3"] = 3
+
+    with lru_cache.open(path, backend="sqlite") as cache:
+        assert list(cache.items()) == [("key2", 2), ("key3", 3)]
+
+
+def test_open_sqlite_close_from_other_thread(tmp_path: Path) -> None:
+    path = tmp_path / "cache.db"
+    with lru_cache.open(path, backend="sqlite") as cache:
+        cache["key"] = 1
+
+    caches: list[lru_cache.BasePersistentLRUCache] = []
+
+    thread = threading.Thread(
+        target=lambda: caches.append(lru_cache.open(path, backend="sqlite"))
+    )
+    thread.start()
+    thread.join()
+    cache = caches.pop()
+    cache["key"] = 2
+    cache.close()
+
+    with lru_cache.open(path, backend="sqlite") as cache:
+        assert cache["key"] == 2
+
+
+def test_open_sqlite_has_no_pickle_state(tmp_path: Path) -> None:
+    with lru_cache.open(tmp_path / "cache.db", backend="sqlite") as cache:
+        assert isinstance(cache, lru_cache.BasePersistentLRUCache)
+        assert not isinstance(cache, PersistentLRUCache)
+        assert not hasattr(cache, "journal_filename")
+        assert not hasattr(cache, "optimize_on_save")
+
+
+def test_open_sqlite_unsupported_options(tmp_path: Path) -> None:
+    path = tmp_path / "cache.db"
+    with pytest.raises(ValueError, match="journal_threshold"):
+        lru_cache.open(path, journal_threshold=10, backend="sqlite")
+    with pytest.raises(ValueError, match="optimize_on_save"):
+        lru_cache.open(path, optimize_on_save=True, backend="sqlite")
+
+
+def test_open_unknown_backend(tmp_path: Path) -> None:
+    with pytest.raises(ValueError, match="unknown backend"):
+        lru_cache.open(tmp_path / "cache", backend="shelve")  # type: ignore[arg-type]
+
+
 def test_bytesize() -> None:
     assert bytesize(b=1) == 1
     assert bytesize(kb=1) == 1024